@@ -1,40 +1,210 @@
-from sqlalchemy import event
-from sqlmodel import SQLModel, Session, create_engine
-from pathlib import Path
-from functools import lru_cache
-
-DB_PATH = (Path(__file__).resolve().parent.parent / "erp.db").resolve()
-
-def _on_sqlite_connect(dbapi_conn, _conn_record):
-    cur = dbapi_conn.cursor()
-    cur.execute("PRAGMA foreign_keys = ON;")
-    cur.execute("PRAGMA journal_mode = WAL;")
-    cur.execute("PRAGMA synchronous = NORMAL;")
-    cur.close()
-
-def _make_engine(db_file: Path):
-    engine = create_engine(
-        f"sqlite:///{db_file}",
-        connect_args={"check_same_thread": False},
-        pool_pre_ping=True,
-        future=True,
-    )
-    # registra o hook no Engine síncrono
-    event.listen(engine, "connect", _on_sqlite_connect)
-    return engine
-
-_default_engine = _make_engine(DB_PATH)
-
-def init_db() -> None:
-    from . import models  # registra tabelas
-    SQLModel.metadata.create_all(_default_engine)
-
-def get_session() -> Session:
-    return Session(_default_engine)
-
-@lru_cache(maxsize=32)
-def _engine_for(path_str: str):
-    return _make_engine(Path(path_str))
-
-def get_session_for(db_path: Path) -> Session:
-    return Session(_engine_for(str(db_path.resolve())))
+import asyncio
+import atexit
+import os
+import threading
+from cachetools import LRUCache
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import (
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+from sqlalchemy.pool import QueuePool
+from sqlmodel import SQLModel, Session, create_engine
+from pathlib import Path
+
+DB_PATH = (Path(__file__).resolve().parent.parent / "erp.db").resolve()
+
+# Leitores escalam com os núcleos sob WAL; o escritor é serializado pelo SQLite
+_READ_POOL_SIZE = os.cpu_count() or 4
+
+
+def _on_sqlite_connect(dbapi_conn, _conn_record):
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA foreign_keys = ON;")
+    cur.execute("PRAGMA journal_mode = WAL;")
+    cur.execute("PRAGMA synchronous = NORMAL;")
+    _tuning_pragmas(cur)
+    cur.close()
+
+
+def _on_sqlite_connect_ro(dbapi_conn, _conn_record):
+    # Conexão read-only: não pode mudar journal_mode, o resto se aplica igual
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA foreign_keys = ON;")
+    _tuning_pragmas(cur)
+    cur.close()
+
+
+def _tuning_pragmas(cur) -> None:
+    # Espera até 5s por locks em vez de falhar com SQLITE_BUSY imediato
+    cur.execute("PRAGMA busy_timeout = 5000;")
+    # ~20MB de page cache por conexão (valor negativo = KiB)
+    cur.execute("PRAGMA cache_size = -20000;")
+    cur.execute("PRAGMA temp_store = MEMORY;")
+    # mmap não se aplica a bancos em memória
+    cur.execute("PRAGMA database_list;")
+    main_db = cur.fetchone()
+    if main_db and main_db[2]:  # (seq, name, file) — file vazio => :memory:
+        # 256MB de I/O memory-mapped: páginas quentes saem direto do mmap
+        cur.execute("PRAGMA mmap_size = 268435456;")
+
+
+def _on_sqlite_begin(conn):
+    # Com isolation_level=None o pysqlite não abre transação sozinho;
+    # BEGIN IMMEDIATE pega o write-lock já no início e evita deadlock tardio
+    conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def _ro_url(db_file: Path, *, immutable: bool) -> str:
+    # immutable=1: o SQLite assume que o arquivo nunca muda — sem locks e
+    # sem criação de sidecars -wal/-shm; só vale para bases de upload
+    url = f"file:{db_file}?mode=ro&uri=true"
+    if immutable:
+        url += "&immutable=1"
+    return url
+
+
+def _make_engine(db_file: Path, *, writer: bool, immutable: bool = False):
+    if writer:
+        engine = create_engine(
+            f"sqlite:///{db_file}",
+            connect_args={"check_same_thread": False, "isolation_level": None},
+            poolclass=QueuePool,
+            pool_size=1,
+            max_overflow=0,
+            pool_pre_ping=True,
+            future=True,
+            query_cache_size=1200,
+            execution_options={"compiled_cache": {}},
+        )
+        event.listen(engine, "connect", _on_sqlite_connect)
+        event.listen(engine, "begin", _on_sqlite_begin)
+    else:
+        engine = create_engine(
+            f"sqlite:///{_ro_url(db_file, immutable=immutable)}",
+            connect_args={"check_same_thread": False},
+            poolclass=QueuePool,
+            pool_size=_READ_POOL_SIZE,
+            max_overflow=0,
+            pool_pre_ping=True,
+            future=True,
+            query_cache_size=1200,
+            execution_options={"compiled_cache": {}},
+        )
+        event.listen(engine, "connect", _on_sqlite_connect_ro)
+    return engine
+
+
+def _make_async_read_engine(db_file: Path, *, immutable: bool = False):
+    # Leitura assíncrona via aiosqlite: SELECTs longos devolvem o event loop
+    # em vez de travar todas as requisições concorrentes do /ask
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{_ro_url(db_file, immutable=immutable)}",
+        pool_size=_READ_POOL_SIZE,
+        max_overflow=0,
+        pool_pre_ping=True,
+        query_cache_size=1200,
+        execution_options={"compiled_cache": {}},
+    )
+    # eventos DBAPI são registrados no engine síncrono subjacente
+    event.listen(engine.sync_engine, "connect", _on_sqlite_connect_ro)
+    return engine
+
+
+_write_engine = _make_engine(DB_PATH, writer=True)
+_read_engine = _make_engine(DB_PATH, writer=False)
+_async_read_engine = _make_async_read_engine(DB_PATH)
+_async_read_session = async_sessionmaker(_async_read_engine, expire_on_commit=False)
+
+
+def init_db() -> None:
+    from . import models  # registra tabelas
+    SQLModel.metadata.create_all(_write_engine)
+
+
+def get_read_session() -> Session:
+    return Session(_read_engine)
+
+
+def get_write_session() -> Session:
+    return Session(_write_engine)
+
+
+# Compat: o padrão histórico era uma sessão única; leitura é o caso comum
+def get_session() -> Session:
+    return get_read_session()
+
+
+def get_async_read_session() -> AsyncSession:
+    return _async_read_session()
+
+
+def _dispose_engine(engine) -> None:
+    sync_engine = getattr(engine, "sync_engine", None)
+    if sync_engine is None:
+        engine.dispose()
+        return
+    # AsyncEngine: fechar conexões aiosqlite exige o event loop. Em eviction
+    # (dentro de uma rota) agenda o dispose; no atexit não há loop — descarta
+    # o pool sem fechar as conexões, os FDs morrem com o processo.
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    if loop is not None:
+        loop.create_task(engine.dispose())
+    else:
+        sync_engine.dispose(close=False)
+
+
+class _EngineCache(LRUCache):
+    """LRU de engines que chama dispose() ao evictar.
+
+    O lru_cache da stdlib descartava o engine silenciosamente, vazando os
+    descritores de arquivo do SQLite sob churn de uploads.
+    """
+
+    def popitem(self):
+        key, engine = super().popitem()
+        _dispose_engine(engine)
+        return key, engine
+
+
+_engine_cache_lock = threading.Lock()
+_upload_engines: _EngineCache = _EngineCache(maxsize=32)
+_upload_async_engines: _EngineCache = _EngineCache(maxsize=32)
+
+
+@atexit.register
+def _dispose_cached_engines() -> None:
+    with _engine_cache_lock:
+        for engine in (*_upload_engines.values(), *_upload_async_engines.values()):
+            _dispose_engine(engine)
+
+
+def _engine_for(path_str: str):
+    # Bases enviadas por upload são apenas consultadas, nunca escritas
+    with _engine_cache_lock:
+        engine = _upload_engines.get(path_str)
+        if engine is None:
+            engine = _make_engine(Path(path_str), writer=False, immutable=True)
+            _upload_engines[path_str] = engine
+        return engine
+
+
+def get_session_for(db_path: Path) -> Session:
+    return Session(_engine_for(str(db_path.resolve())))
+
+
+def _async_engine_for(path_str: str):
+    with _engine_cache_lock:
+        engine = _upload_async_engines.get(path_str)
+        if engine is None:
+            engine = _make_async_read_engine(Path(path_str), immutable=True)
+            _upload_async_engines[path_str] = engine
+        return engine
+
+
+def get_async_session_for(db_path: Path) -> AsyncSession:
+    return AsyncSession(_async_engine_for(str(db_path.resolve())), expire_on_commit=False)
@@ -4,20 +4,25 @@ from __future__ import annotations
 import os
 import traceback
 import uuid
+from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import Any, List, Optional, Tuple
 
+import aiofiles
+from cachetools import LRUCache
+
 from dotenv import load_dotenv
 from fastapi import FastAPI, File, HTTPException, UploadFile
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, ORJSONResponse
 from pydantic import BaseModel
 from sqlalchemy import text
-from sqlmodel import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
 
-from .db import get_session, get_session_for, init_db
-from .nl2sql import question_to_sql  # <- sua versão já com suporte a schema_md (opcional)
+from .db import get_async_read_session, get_async_session_for, init_db
+from .nl2sql import close_ollama_client, question_to_sql  # <- sua versão já com suporte a schema_md (opcional)
 from .sql_guard import sanitize
-from .utils import schema_markdown_from_sqlite
+from .utils import schema_markdown_cached
 
 # -----------------------------------------------------------------------------
 # Config
@@ -25,6 +30,7 @@ from .utils import schema_markdown_from_sqlite
 load_dotenv()
 
 RESULT_LIMIT: int = int(os.getenv("RESULT_LIMIT", "200"))
+_DEFAULT_DB = Path(__file__).resolve().parent.parent / "erp.db"
 _UI_PATH = Path(__file__).parent / "ui" / "index.html"
 _UPLOAD_DIR = Path(__file__).parent / "uploads"
 _UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
@@ -32,7 +38,27 @@ _UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 # Mapa in-memory: db_id -> path
 _DB_REGISTRY: dict[str, Path] = {}
 
-app = FastAPI(title="Agente NL - SQL", version="1.1")
+# Veredito do EXPLAIN QUERY PLAN por (base, sql): query repetida pula o planner
+_PLAN_CACHE: LRUCache = LRUCache(maxsize=512)
+
+# -----------------------------------------------------------------------------
+# Lifespan
+# -----------------------------------------------------------------------------
+@asynccontextmanager
+async def _lifespan(app: FastAPI):
+    """Cria as tabelas do demo (erp.db) para quem não quiser enviar .db."""
+    init_db()
+    # pré-computa o schema da base padrão: o /ask sem db_id só paga um stat()
+    app.state.default_schema_md = schema_markdown_cached(_DEFAULT_DB)
+    app.state.default_schema_mtime = _DEFAULT_DB.stat().st_mtime_ns
+    yield
+    # fecha o pool de conexões keep-alive com o Ollama
+    await close_ollama_client()
+
+# orjson serializa ~3-5x mais rápido que o json da stdlib
+app = FastAPI(title="Agente NL - SQL", version="1.1",
+              default_response_class=ORJSONResponse,
+              lifespan=_lifespan)
 
 # -----------------------------------------------------------------------------
 # Models
@@ -51,39 +77,47 @@ class AskResponse(BaseModel):
     ambiguidade: Optional[str] = None
     answer: Optional[str] = None  # se seu nl2sql gerar resposta natural
 
-# -----------------------------------------------------------------------------
-# Startup
-# -----------------------------------------------------------------------------
-@app.on_event("startup")
-def _startup() -> None:
-    """Cria as tabelas do demo (erp.db) para quem não quiser enviar .db."""
-    init_db()
-
 # -----------------------------------------------------------------------------
 # Helpers
 # -----------------------------------------------------------------------------
-def _resolve_db(db_id: Optional[str]) -> Tuple[Session, Optional[Path]]:
+def _resolve_db(db_id: Optional[str]) -> Tuple[AsyncSession, Optional[Path]]:
     """
-    Retorna (Session, db_path) para a base escolhida.
+    Retorna (AsyncSession, db_path) para a base escolhida.
     - se db_id vier preenchido e existir no registry, usa essa base
     - caso contrário, usa a base demo padrão (erp.db)
     """
     if db_id and db_id in _DB_REGISTRY:
         db_path = _DB_REGISTRY[db_id]
-        return get_session_for(db_path), db_path
-    return get_session(), None  # base padrão
+        return get_async_session_for(db_path), db_path
+    return get_async_read_session(), None  # base padrão (pool de leitura)
 
 def _schema_md_for(db_path: Optional[Path]) -> str:
     """Gera markdown do schema da base informada (ou vazio se usar engine padrão
        e você preferir manter o comportamento antigo)."""
     if db_path is None:
-        # Opcional: se quiser também descrever o schema da base padrão,
-        # aponte para o caminho do erp.db aqui.
-        default_db = Path(__file__).resolve().parent.parent / "erp.db"
-        if default_db.exists():
-            return schema_markdown_from_sqlite(default_db)
-        return ""
-    return schema_markdown_from_sqlite(db_path)
+        # Base padrão: usa o markdown pré-computado no startup e só
+        # recomputa se o arquivo mudou desde então (comparação de mtime).
+        if not _DEFAULT_DB.exists():
+            return ""
+        mtime_ns = _DEFAULT_DB.stat().st_mtime_ns
+        if getattr(app.state, "default_schema_mtime", None) != mtime_ns:
+            app.state.default_schema_md = schema_markdown_cached(_DEFAULT_DB)
+            app.state.default_schema_mtime = mtime_ns
+        return app.state.default_schema_md
+    return schema_markdown_cached(db_path)
+
+def _plan_is_cheap(plan_rows) -> bool:
+    """
+    Heurística sobre o EXPLAIN QUERY PLAN: até 2 full scans sem índice são
+    aceitos; acima disso (cross joins acidentais da LLM) a consulta é vetada
+    antes de queimar CPU. SEARCH/SCAN ... USING INDEX não contam.
+    """
+    full_scans = 0
+    for row in plan_rows:
+        detail = str(row[-1])  # última coluna = detail
+        if detail.startswith("SCAN") and "USING INDEX" not in detail:
+            full_scans += 1
+    return full_scans <= 2
 
 # -----------------------------------------------------------------------------
 # Routes
@@ -113,8 +147,20 @@ async def upload_db(file: UploadFile = File(...)) -> JSONResponse:
             )
         db_id = uuid.uuid4().hex
         dst = _UPLOAD_DIR / f"{db_id}_{name}"
-        content = await file.read()
-        dst.write_bytes(content)
+        # grava em chunks de 1MB: memória O(1) mesmo para .db de centenas de MB
+        async with aiofiles.open(dst, "wb") as out:
+            while chunk := await file.read(1 << 20):
+                await out.write(chunk)
+        # valida o magic header antes de registrar: arquivo corrompido não
+        # chega a criar engine nem sidecar WAL
+        async with aiofiles.open(dst, "rb") as f:
+            header = await f.read(16)
+        if header != b"SQLite format 3\x00":
+            dst.unlink(missing_ok=True)
+            return JSONResponse(
+                status_code=400,
+                content={"detail": "Arquivo não é um banco SQLite válido."},
+            )
         _DB_REGISTRY[db_id] = dst
         return JSONResponse({"db_id": db_id, "name": name})
     except Exception as e:
@@ -139,8 +185,10 @@ async def ask(payload: AskRequest) -> AskResponse:
                            mensagem="Pergunta muito curta.")
 
     # 1) resolve DB e schema (seu nl2sql pode usar isso no prompt)
+    # a reflexão do schema usa sqlite3 síncrono; em cache miss ela sai do
+    # event loop para o threadpool para não segurar requisições concorrentes
     session, db_path = _resolve_db(payload.db_id)
-    schema_md = _schema_md_for(db_path)
+    schema_md = await run_in_threadpool(_schema_md_for, db_path)
 
     # 2) NL -> SQL
     try:
@@ -169,11 +217,22 @@ async def ask(payload: AskRequest) -> AskResponse:
 
     safe_sql = safe_sql_or_err
 
-    # 4) Execução
+    # 4) Execução (assíncrona: SELECTs lentos não bloqueiam o event loop)
     try:
-        with session as s:  # type: Session
-            result = s.exec(text(safe_sql))
-            rows = [list(r) for r in result.fetchall()]
+        async with session as s:
+            # preflight barato: o planner do SQLite denuncia cross joins
+            plan_key = (str(db_path) if db_path else "", safe_sql)
+            plan_ok = _PLAN_CACHE.get(plan_key)
+            if plan_ok is None:
+                plan = (await s.execute(text("EXPLAIN QUERY PLAN " + safe_sql))).fetchall()
+                plan_ok = _plan_is_cheap(plan)
+                _PLAN_CACHE[plan_key] = plan_ok
+            if not plan_ok:
+                return AskResponse(ok=False, sql=safe_sql, rows=None, columns=None,
+                                   mensagem="Consulta muito custosa; refine a pergunta.")
+            result = await s.execute(text(safe_sql))
+            # tuple() é implementado em C; Row já é tuple-like
+            rows = [tuple(r) for r in result.fetchall()]
             columns = list(result.keys())
     except Exception as e:
         traceback.print_exc()
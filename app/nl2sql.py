@@ -11,6 +11,7 @@ Gera SQL (SQLite) a partir de pergunta em PT-BR usando um modelo local via Ollam
 Dependências: httpx, python-dotenv
 """
 
+import hashlib
 import os
 import re
 import json
@@ -19,6 +20,7 @@ from pathlib import Path
 from typing import Iterable, Sequence
 
 import httpx
+from cachetools import LRUCache
 from dotenv import load_dotenv
 
 # Garante que carregamos o .env correto (dentro de app/)
@@ -30,70 +32,164 @@ OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "60"))
 
 # ---------- Low level: chamada ao Ollama (chat) ----------
 
-async def _ollama_chat(messages: list[dict], temperature: float = 0.0) -> str:
+# Cliente único reutilizado entre requests: evita handshake TCP + setup de
+# conexão a cada pergunta (keep-alive com o Ollama local).
+_client: httpx.AsyncClient | None = None
+
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            base_url=OLLAMA_BASE_URL,
+            timeout=OLLAMA_TIMEOUT,
+            limits=httpx.Limits(max_keepalive_connections=8, max_connections=16),
+        )
+    return _client
+
+
+async def close_ollama_client() -> None:
+    """Fecha o cliente compartilhado; chamado no shutdown do app."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def _ollama_chat(
+    messages: list[dict],
+    temperature: float = 0.0,
+    *,
+    stop_when=None,
+) -> str:
     """
-    Chama /api/chat do Ollama e retorna o conteúdo textual da última mensagem.
+    Chama /api/chat do Ollama (streaming) e retorna o texto acumulado.
     `messages` é no formato OpenAI-like: [{"role":"user"|"system"|"assistant","content":"..."}]
+
+    `stop_when(buf)` opcional: se retornar True, abandona o stream na hora —
+    para SQL de uma linha isso corta boa parte do tempo de decodificação do
+    modelo (o context exit fecha a conexão e o Ollama para de gerar).
     """
-    url = f"{OLLAMA_BASE_URL}/api/chat"
     payload = {
         "model": OLLAMA_MODEL,
         "messages": messages,
-        "stream": False,
+        "stream": True,
         "options": {"temperature": temperature},
     }
-    async with httpx.AsyncClient(timeout=OLLAMA_TIMEOUT) as cli:
-        r = await cli.post(url, json=payload)
+    parts: list[str] = []
+    async with _get_client().stream("POST", "/api/chat", json=payload) as r:
         r.raise_for_status()
-        data = r.json()
-        # Estrutura típica do Ollama: {"message":{"role":"assistant","content":"..."}}
-        return (data.get("message") or {}).get("content", "") or ""
+        # Cada linha é um JSON: {"message":{"role":"assistant","content":"..."},"done":bool}
+        async for line in r.aiter_lines():
+            if not line.strip():
+                continue
+            chunk = json.loads(line)
+            content = (chunk.get("message") or {}).get("content", "")
+            if content:
+                parts.append(content)
+            if chunk.get("done"):
+                break
+            if stop_when is not None and content and stop_when("".join(parts)):
+                break
+    return "".join(parts)
+
+
+def _buf_ends_query(buf: str) -> bool:
+    """
+    True quando o buffer parcial já contém um SELECT completo: há um ';',
+    uma linha em branco depois do SELECT ou o fechamento de um codeblock —
+    todos fora de literal de string, senão um ';' dentro de um literal
+    cortado ao meio pelo stream abortaria a query truncada.
+    Um '\\n' simples não basta — SELECTs multi-linha são comuns.
+    O buffer inteiro é re-escaneado a cada chunk, então o estado de aspas
+    nunca fica desatualizado entre chamadas.
+    """
+    i = buf.lower().find("select")
+    if i == -1:
+        return False
+    rest = buf[i:]
+    n = len(rest)
+    in_str = False
+    j = 0
+    while j < n:
+        ch = rest[j]
+        if in_str:
+            if ch == "'":
+                if j + 1 < n and rest[j + 1] == "'":
+                    j += 2  # '' é aspas escapada dentro do literal
+                    continue
+                in_str = False
+        elif ch == "'":
+            in_str = True
+        elif ch == ";":
+            return True
+        elif ch == "\n" and rest.startswith("\n", j + 1):
+            return True
+        elif ch == "`" and rest.startswith("``", j + 1):
+            return True
+        j += 1
+    return False
 
 
 # ---------- Helpers de limpeza ----------
 
-_CODEBLOCK_RE = re.compile(
-    r"```(?:sql|SQL)?\s*(?P<body>[\s\S]*?)```", re.IGNORECASE
-)
-
-def _extract_sql_from_codeblock(text: str) -> str | None:
+def _find_select(low: str) -> int:
     """
-    Se a LLM devolver um bloco cercado por ```sql ... ```, extrai só o conteúdo.
+    Índice do primeiro SELECT com fronteira de palavra em `low` (já lowercase),
+    ou -1. str.find roda em C; o loop só itera em falsos positivos raros
+    ("selected", nomes de coluna etc.).
     """
-    m = _CODEBLOCK_RE.search(text)
-    if not m:
-        return None
-    return m.group("body").strip()
+    i = low.find("select")
+    while i != -1:
+        before_ok = i == 0 or not (low[i - 1].isalnum() or low[i - 1] == "_")
+        j = i + 6
+        after_ok = j >= len(low) or not (low[j].isalnum() or low[j] == "_")
+        if before_ok and after_ok:
+            return i
+        i = low.find("select", i + 1)
+    return -1
 
 
 def _strip_markdown(text: str) -> str:
     """
     Remove cercas, prefixos "sql:" ou "SQL:", e linhas vazias iniciais.
     Mantém apenas o que parece ser a consulta.
+
+    Implementado com str.find/slicing (C-level) em vez da cadeia de regex
+    antiga — o caminho quente roda uma única varredura linear.
     """
     text = text.strip()
 
-    # Se houver codeblock, priorize-o.
-    block = _extract_sql_from_codeblock(text)
-    if block:
-        text = block
+    # Se houver codeblock ```sql ... ```, priorize o conteúdo dele.
+    open_idx = text.find("```")
+    if open_idx != -1:
+        body_start = open_idx + 3
+        if text[body_start:body_start + 3].lower() == "sql":
+            body_start += 3
+        close_idx = text.find("```", body_start)
+        if close_idx != -1:
+            text = text[body_start:close_idx].strip()
 
     # Remove crases soltas
     text = text.strip("`").strip()
 
-    # Remover prefixos como "SQL:", "sql:", "Consulta SQL:", etc.
-    text = re.sub(r"^\s*(?i:sql|consulta|query)\s*:\s*", "", text).strip()
+    # Remover prefixos como "SQL:", "sql:", "Consulta:", "Query:" etc.
+    low = text.lower()
+    for prefix in ("sql", "consulta", "query"):
+        if low.startswith(prefix):
+            rest = text[len(prefix):].lstrip()
+            if rest.startswith(":"):
+                text = rest[1:].lstrip()
+            break
 
     # Caso o modelo escreva "SELECT ..." numa linha após algum cabeçalho
     # pegue a partir da primeira ocorrência de SELECT.
-    m = re.search(r"(?is)\bselect\b", text)
-    if m:
-        text = text[m.start():].strip()
-
-    # Remove ponto-e-vírgula final duplicado
-    text = re.sub(r";+\s*$", "", text)
+    i = _find_select(text.lower())
+    if i != -1:
+        text = text[i:].strip()
 
-    return text.strip()
+    # Remove ponto-e-vírgula final (possivelmente duplicado)
+    return text.rstrip().rstrip(";").rstrip()
 
 
 def _looks_like_select(sql: str) -> bool:
@@ -134,6 +230,20 @@ Regras adicionais:
 SQL:
 """
 
+# Cache de SQL já gerado: a chamada à LLM domina a latência do /ask por
+# ordens de grandeza, então pergunta repetida contra o mesmo schema responde
+# direto daqui. Chave por hash: evita reter perguntas/schemas longos inteiros.
+_SQL_CACHE: LRUCache = LRUCache(maxsize=1024)
+
+
+def _sql_cache_key(question: str, schema_txt: str) -> tuple[str, str, str]:
+    return (
+        hashlib.blake2b(question.encode(), digest_size=16).hexdigest(),
+        hashlib.blake2b(schema_txt.encode(), digest_size=16).hexdigest(),
+        OLLAMA_MODEL,
+    )
+
+
 async def question_to_sql(
     question: str,
     schema_md: str | None = None,
@@ -145,10 +255,17 @@ async def question_to_sql(
     Gera SQL puro (apenas SELECT) a partir de `question` + `schema_md`.
     - Limpa cercas/markdown automaticamente.
     - Retorna None se não houver como extrair SELECT plausível.
+    - Resultados válidos ficam em cache por (pergunta, schema, modelo).
 
     `retries` faz 1 re-tentativa com instrução ainda mais rígida caso a primeira falhe.
     """
     schema_txt = schema_md or "/* Schema indisponível */"
+
+    cache_key = _sql_cache_key(question, schema_txt)
+    cached = _SQL_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+
     user_prompt = _SQL_USER_TEMPLATE.format(schema_md=schema_txt, question=question)
 
     async def _once(extra_hint: str = "") -> str | None:
@@ -156,7 +273,8 @@ async def question_to_sql(
             {"role": "system", "content": _SQL_SYSTEM_INSTRUCTIONS + extra_hint},
             {"role": "user", "content": user_prompt},
         ]
-        raw = await _ollama_chat(msgs, temperature=temperature)
+        raw = await _ollama_chat(msgs, temperature=temperature,
+                                 stop_when=_buf_ends_query)
         sql = _strip_markdown(raw)
         if not sql or not _looks_like_select(sql):
             return None
@@ -164,6 +282,7 @@ async def question_to_sql(
 
     sql = await _once()
     if sql:
+        _SQL_CACHE[cache_key] = sql
         return sql
 
     # Uma re-tentativa, apertando as regras
@@ -174,6 +293,7 @@ async def question_to_sql(
         )
         sql = await _once(strict)
         if sql:
+            _SQL_CACHE[cache_key] = sql
             return sql
 
     return None
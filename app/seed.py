@@ -3,9 +3,8 @@ from __future__ import annotations
 from datetime import date
 from random import randint, choice, random, seed as rndseed
 from pathlib import Path
-from sqlalchemy import text
-from sqlmodel import Session
-from .db import engine, init_db, DB_PATH
+from sqlalchemy import insert, text
+from .db import get_write_session, init_db, DB_PATH
 from .models import Cliente, Produto, Pedido, ItemPedido, Pagamento
 
 # ---------- Parâmetros do seed (ajuste à vontade) ----------
@@ -26,6 +25,20 @@ CATEGORIAS = ["Eletrônicos","Acessórios","Mobiliário","Papelaria","Serviços"
 
 rndseed(42)  # determinístico
 
+# text() construídos uma vez: chave estável no cache de statements do engine
+_DELETE_STMTS = [
+    text("DELETE FROM pagamento"),
+    text("DELETE FROM itempedido"),
+    text("DELETE FROM pedido"),
+    text("DELETE FROM produto"),
+    text("DELETE FROM cliente"),
+]
+# um statement só para as 5 contagens, em vez de 5 round-trips
+_COUNT_TABLES = ("cliente", "produto", "pedido", "itempedido", "pagamento")
+_COUNT_STMT = text(
+    "SELECT " + ", ".join(f"(SELECT COUNT(*) FROM {tbl})" for tbl in _COUNT_TABLES)
+)
+
 def _mk_nome_prod(i: int) -> str:
     base = ["Notebook","Mouse","Teclado","Cadeira","Monitor","Impressora","Headset","HD Externo",
             "Webcam","Cabo HDMI","Caderno","Caneta","Suporte Notebook","Mesa Escritório"]
@@ -35,67 +48,90 @@ def run() -> None:
     init_db()
     print(f"Usando DB em: {Path(DB_PATH).resolve()}")
 
-    with Session(engine) as s:
-        # limpa na ordem certa (FKs)
-        s.exec(text("DELETE FROM pagamento"))
-        s.exec(text("DELETE FROM itempedido"))
-        s.exec(text("DELETE FROM pedido"))
-        s.exec(text("DELETE FROM produto"))
-        s.exec(text("DELETE FROM cliente"))
-
-        # clientes
-        clientes: list[Cliente] = []
-        for i in range(CLIENTES):
-            cidade, uf = choice(CIDADES)
-            c = Cliente(
-                nome=f"Cliente {i+1}",
-                email=f"cliente{i+1}@ex.com",
-                cidade=cidade,
-                estado=uf,
-            )
-            s.add(c); clientes.append(c)
-
-        # produtos
-        produtos: list[Produto] = []
-        for i in range(PRODUTOS):
-            nome = _mk_nome_prod(i+1)
-            cat = choice(CATEGORIAS)
-            preco = round(50 + 3000 * random(), 2)
-            p = Produto(nome=nome, categoria=cat, preco_base=preco)
-            s.add(p); produtos.append(p)
+    with get_write_session() as s:
+        # Uma única transação: sem flush por linha nem autoflush no meio.
+        # insert() multi-linha usa o fast path insertmanyvalues do SQLAlchemy
+        # (lotes grandes por statement, dicts em vez de objetos ORM).
+        with s.begin():
+            # limpa na ordem certa (FKs)
+            for stmt in _DELETE_STMTS:
+                s.exec(stmt)
 
-        s.commit()  # garante IDs
+            # clientes
+            clientes_rows = []
+            for i in range(CLIENTES):
+                cidade, uf = choice(CIDADES)
+                clientes_rows.append({
+                    "nome": f"Cliente {i+1}",
+                    "email": f"cliente{i+1}@ex.com",
+                    "cidade": cidade,
+                    "estado": uf,
+                })
+            cliente_ids = s.execute(
+                insert(Cliente).returning(Cliente.id), clientes_rows
+            ).scalars().all()
 
-        # pedidos + itens + pagamentos
-        total_pedidos = 0
-        for ano in ANOS:
-            for mes in range(1, 13):
-                for _ in range(randint(PEDIDOS_POR_MES_MIN, PEDIDOS_POR_MES_MAX)):
-                    cli = choice(clientes)
-                    ped = Pedido(data=date(ano, mes, randint(1, 28)), cliente_id=cli.id)
-                    s.add(ped); s.flush()  # libera ped.id
+            # produtos (guarda o preço junto do id para precificar itens)
+            produtos_rows = [
+                {
+                    "nome": _mk_nome_prod(i + 1),
+                    "categoria": choice(CATEGORIAS),
+                    "preco_base": round(50 + 3000 * random(), 2),
+                }
+                for i in range(PRODUTOS)
+            ]
+            produto_ids = s.execute(
+                insert(Produto).returning(Produto.id), produtos_rows
+            ).scalars().all()
+            produtos = list(zip(produto_ids, (p["preco_base"] for p in produtos_rows)))
 
-                    total = 0.0
-                    for _ in range(randint(ITENS_POR_PEDIDO_MIN, ITENS_POR_PEDIDO_MAX)):
-                        pr = choice(produtos)
-                        q = randint(1, 5)
-                        price = round(pr.preco_base * (0.85 + 0.35 * random()), 2)
-                        s.add(ItemPedido(pedido_id=ped.id, produto_id=pr.id, quantidade=q, preco_unitario=price))
-                        total += q * price
+            # pedidos primeiro (RETURNING id preserva a ordem das linhas)...
+            pedidos_rows = []
+            for ano in ANOS:
+                for mes in range(1, 13):
+                    for _ in range(randint(PEDIDOS_POR_MES_MIN, PEDIDOS_POR_MES_MAX)):
+                        pedidos_rows.append({
+                            "data": date(ano, mes, randint(1, 28)),
+                            "cliente_id": choice(cliente_ids),
+                        })
+            pedido_ids = s.execute(
+                insert(Pedido).returning(Pedido.id), pedidos_rows
+            ).scalars().all()
 
-                    s.add(Pagamento(pedido_id=ped.id, forma=choice(FORMAS), valor=round(total, 2), status="liquidado"))
-                    total_pedidos += 1
+            # ...depois itens e pagamentos referenciando os ids gerados
+            itens_rows = []
+            pagamentos_rows = []
+            for ped_id in pedido_ids:
+                total = 0.0
+                for _ in range(randint(ITENS_POR_PEDIDO_MIN, ITENS_POR_PEDIDO_MAX)):
+                    prod_id, preco_base = choice(produtos)
+                    q = randint(1, 5)
+                    price = round(preco_base * (0.85 + 0.35 * random()), 2)
+                    itens_rows.append({
+                        "pedido_id": ped_id,
+                        "produto_id": prod_id,
+                        "quantidade": q,
+                        "preco_unitario": price,
+                    })
+                    total += q * price
+                pagamentos_rows.append({
+                    "pedido_id": ped_id,
+                    "forma": choice(FORMAS),
+                    "valor": round(total, 2),
+                    "status": "liquidado",
+                })
 
-        s.commit()
+            s.execute(insert(ItemPedido), itens_rows)
+            s.execute(insert(Pagamento), pagamentos_rows)
 
         # contagens finais
-        def count(tbl): return s.exec(text(f"SELECT COUNT(*) FROM {tbl}")).one()[0]
+        n_cli, n_prod, n_ped, n_item, n_pag = s.exec(_COUNT_STMT).one()
         print("Contagens após seed:")
-        print("  clientes :", count("cliente"))
-        print("  produtos :", count("produto"))
-        print("  pedidos  :", count("pedido"))
-        print("  itens    :", count("itempedido"))
-        print("  pagamentos:", count("pagamento"))
+        print("  clientes :", n_cli)
+        print("  produtos :", n_prod)
+        print("  pedidos  :", n_ped)
+        print("  itens    :", n_item)
+        print("  pagamentos:", n_pag)
 
 if __name__ == "__main__":
     run()
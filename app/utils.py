@@ -2,6 +2,7 @@
 from __future__ import annotations
 
 import sqlite3
+from functools import lru_cache
 from pathlib import Path
 from typing import List
 
@@ -58,6 +59,10 @@ def schema_markdown_from_sqlite(db_path: Path) -> str:
     """
     Gera um resumo em Markdown do esquema (tabelas, colunas e FKs) a partir de um arquivo SQLite.
     Ignora tabelas internas do SQLite (sqlite_%).
+
+    Usa as funções table-valued pragma_table_info/pragma_foreign_key_list
+    juntas com sqlite_master: 2 statements no total, em vez de 2 PRAGMAs
+    por tabela.
     """
     if not db_path.exists():
         return f"/* Arquivo não encontrado: {db_path} */"
@@ -65,47 +70,71 @@ def schema_markdown_from_sqlite(db_path: Path) -> str:
     lines: List[str] = []
     try:
         with sqlite3.connect(db_path) as con:
-            # Lista tabelas de usuário
-            cur = con.execute(
-                "SELECT name FROM sqlite_master "
-                "WHERE type='table' AND name NOT LIKE 'sqlite_%' "
-                "ORDER BY name"
-            )
-            tables = [row[0] for row in cur.fetchall()]
-            if not tables:
+            # Colunas de todas as tabelas de usuário em uma consulta
+            col_rows = con.execute(
+                'SELECT m.name, p.name, p.type, p."notnull", p.pk '
+                "FROM sqlite_master m JOIN pragma_table_info(m.name) p "
+                "WHERE m.type='table' AND m.name NOT LIKE 'sqlite_%' "
+                "ORDER BY m.name, p.cid"
+            ).fetchall()
+            if not col_rows:
                 return "/* Banco sem tabelas de usuário */"
 
-            for name in tables:
-                lines.append(f"### Tabela {name}")
-
-                # Colunas
-                cols_info = con.execute(f"PRAGMA table_info({name})").fetchall()
-                # PRAGMA table_info: cid, name, type, notnull, dflt_value, pk
-                cols_txt = []
-                for (_cid, cname, ctype, notnull, _dflt, pk) in cols_info:
-                    flags = []
-                    if pk == 1:
-                        flags.append("PK")
-                    if notnull == 1:
-                        flags.append("NOT NULL")
-                    flag_txt = f" [{' ,'.join(flags)}]" if flags else ""
-                    cols_txt.append(f"{cname} {ctype or 'TEXT'}{flag_txt}")
-                lines.append(f"Colunas: {', '.join(cols_txt) if cols_txt else '(nenhuma)'}")
-
-                # Foreign Keys
-                fk_info = con.execute(f"PRAGMA foreign_key_list({name})").fetchall()
-                # PRAGMA foreign_key_list: id, seq, table, from, to, on_update, on_delete, match
-                if fk_info:
-                    rels = [f"{fk[3]} → {fk[2]}({fk[4]})" for fk in fk_info]
-                    lines.append(f"Relacionamentos: {', '.join(rels)}")
-
-                lines.append("")  # separador
+            # FKs de todas as tabelas em outra consulta
+            fk_rows = con.execute(
+                'SELECT m.name, f."table", f."from", f."to" '
+                "FROM sqlite_master m JOIN pragma_foreign_key_list(m.name) f "
+                "WHERE m.type='table' AND m.name NOT LIKE 'sqlite_%' "
+                "ORDER BY m.name, f.id, f.seq"
+            ).fetchall()
+
+        # Agrupa por tabela (linhas já vêm ordenadas por nome)
+        cols_by_tbl: dict[str, List[str]] = {}
+        for tbl, cname, ctype, notnull, pk in col_rows:
+            flags = []
+            if pk == 1:
+                flags.append("PK")
+            if notnull == 1:
+                flags.append("NOT NULL")
+            flag_txt = f" [{' ,'.join(flags)}]" if flags else ""
+            cols_by_tbl.setdefault(tbl, []).append(f"{cname} {ctype or 'TEXT'}{flag_txt}")
+
+        fks_by_tbl: dict[str, List[str]] = {}
+        for tbl, target_tbl, col_from, col_to in fk_rows:
+            fks_by_tbl.setdefault(tbl, []).append(f"{col_from} → {target_tbl}({col_to})")
+
+        for tbl, cols_txt in cols_by_tbl.items():
+            lines.append(f"### Tabela {tbl}")
+            lines.append(f"Colunas: {', '.join(cols_txt) if cols_txt else '(nenhuma)'}")
+            rels = fks_by_tbl.get(tbl)
+            if rels:
+                lines.append(f"Relacionamentos: {', '.join(rels)}")
+            lines.append("")  # separador
 
     except Exception as e:
         return f"/* Erro ao ler SQLite: {e} */"
 
     return "\n".join(lines).strip() or "/* Banco sem tabelas de usuário */"
 
+@lru_cache(maxsize=64)
+def _schema_markdown_cached(path_str: str, _mtime_ns: int) -> str:
+    # _mtime_ns só participa da chave: arquivo alterado => nova entrada
+    return schema_markdown_from_sqlite(Path(path_str))
+
+
+def schema_markdown_cached(db_path: Path) -> str:
+    """
+    Versão memoizada de `schema_markdown_from_sqlite`, com chave (path, mtime).
+    Evita reabrir o SQLite e repetir os PRAGMAs a cada pergunta; invalida
+    sozinha quando o arquivo muda.
+    """
+    try:
+        mtime_ns = db_path.stat().st_mtime_ns
+    except OSError:
+        return schema_markdown_from_sqlite(db_path)
+    return _schema_markdown_cached(str(db_path.resolve()), mtime_ns)
+
+
 def known_tables(db_path: Path | None = None) -> set[str]:
     """
     Mantém compatibilidade com o sql_guard antigo.